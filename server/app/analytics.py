@@ -1,46 +1,113 @@
 import sqlite3
-from typing import List, Dict, Any
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta, timezone
+from typing import List, Dict, Any, Tuple
+
+from .db import dict_rows
+
+# (host, key, days) -> (stored_at, rows); LRU-ordered, dropped per host when a new run lands
+_ROLLING_CACHE: "OrderedDict[Tuple[str, str, int], Tuple[float, List[Dict[str, Any]]]]" = OrderedDict()
+_ROLLING_CACHE_LOCK = threading.Lock()
+_ROLLING_CACHE_TTL = 30.0
+_ROLLING_CACHE_MAX = 512
+# Bumped by invalidate(); a query that started before the bump must not store its rows
+_HOST_GENERATION: Dict[str, int] = {}
+
+def invalidate(host: str) -> None:
+    # Called after a run for `host` is committed
+    with _ROLLING_CACHE_LOCK:
+        _HOST_GENERATION[host] = _HOST_GENERATION.get(host, 0) + 1
+        for k in [k for k in _ROLLING_CACHE if k[0] == host]:
+            del _ROLLING_CACHE[k]
 
 def rolling_metric(conn: sqlite3.Connection, host: str, key: str, days: int = 30) -> List[Dict[str, Any]]:
-    # Uses SQLite window function for 7-day rolling average
+    cache_key = (host, key, days)
+    now = time.monotonic()
+    with _ROLLING_CACHE_LOCK:
+        hit = _ROLLING_CACHE.get(cache_key)
+        if hit and now - hit[0] < _ROLLING_CACHE_TTL:
+            _ROLLING_CACHE.move_to_end(cache_key)
+            return hit[1]
+        generation = _HOST_GENERATION.get(host, 0)
+
+    rows = _rolling_metric_query(conn, host, key, days)
+
+    with _ROLLING_CACHE_LOCK:
+        if _HOST_GENERATION.get(host, 0) != generation:
+            # A run for this host committed while we were querying; these rows may be stale
+            return rows
+        _ROLLING_CACHE[cache_key] = (now, rows)
+        _ROLLING_CACHE.move_to_end(cache_key)
+        while len(_ROLLING_CACHE) > _ROLLING_CACHE_MAX:
+            _ROLLING_CACHE.popitem(last=False)
+    return rows
+
+def _rolling_metric_query(conn: sqlite3.Connection, host: str, key: str, days: int) -> List[Dict[str, Any]]:
+    # SQLite does the daily aggregation; the 7-row rolling average is a running sum below
+    # Cutoff is bound as a literal in the same ISO format as runs.created_at so the
+    # (host, created_at) index gets a plain range predicate
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=days)).isoformat()
     cur = conn.cursor()
     cur.execute(
         """
-        WITH daily AS (
-          SELECT
-            date(r.created_at) AS d,
-            avg(m.value) AS v
-          FROM runs r
-          JOIN metrics m ON m.run_id = r.id
-          WHERE r.host = ? AND m.key = ?
-            AND r.created_at >= datetime('now', ?)
-          GROUP BY date(r.created_at)
-          ORDER BY date(r.created_at)
-        )
         SELECT
-          d,
-          v,
-          avg(v) OVER (ORDER BY d ROWS BETWEEN 6 PRECEDING AND CURRENT ROW) AS rolling7
-        FROM daily
+          date(r.created_at) AS d,
+          avg(m.value) AS v
+        FROM runs r
+        JOIN metrics m ON m.run_id = r.id
+        WHERE r.host = ? AND m.key = ?
+          AND r.created_at >= ?
+        GROUP BY date(r.created_at)
+        ORDER BY date(r.created_at)
         """,
-        (host, key, f"-{days} days"),
+        (host, key, cutoff),
     )
-    return [dict(row) for row in cur.fetchall()]
+
+    out: List[Dict[str, Any]] = []
+    window: "deque[float]" = deque()
+    running_sum = 0.0
+    for d, v in cur.fetchall():
+        window.append(v)
+        running_sum += v
+        if len(window) > 7:
+            running_sum -= window.popleft()
+        out.append({"d": d, "v": v, "rolling7": running_sum / len(window)})
+    return out
+
+def latest_metrics(conn: sqlite3.Connection, host: str) -> List[Dict[str, Any]]:
+    # Point lookup on the trigger-maintained latest_metrics table (PRIMARY KEY (host, key))
+    cur = conn.cursor()
+    cur.execute("SELECT key, value, created_at FROM latest_metrics WHERE host = ? ORDER BY key", (host,))
+    return dict_rows(cur)
+
+# FULL OUTER JOIN needs SQLite 3.39+; older builds get the LEFT JOIN + UNION ALL equivalent
+if sqlite3.sqlite_version_info >= (3, 39, 0):
+    _COMPARE_SQL = """
+        SELECT
+          COALESCE(a.key, b.key) AS key,
+          a.value AS a,
+          b.value AS b,
+          round(b.value - a.value, 3) AS delta
+        FROM (SELECT key, value FROM metrics WHERE run_id = ?) a
+        FULL OUTER JOIN (SELECT key, value FROM metrics WHERE run_id = ?) b USING (key)
+        ORDER BY 1
+    """
+else:
+    _COMPARE_SQL = """
+        WITH a AS (SELECT key, value FROM metrics WHERE run_id = ?),
+             b AS (SELECT key, value FROM metrics WHERE run_id = ?)
+        SELECT a.key AS key, a.value AS a, b.value AS b, round(b.value - a.value, 3) AS delta
+        FROM a LEFT JOIN b USING (key)
+        UNION ALL
+        SELECT b.key, NULL, b.value, NULL
+        FROM b WHERE b.key NOT IN (SELECT key FROM a)
+        ORDER BY 1
+    """
 
 def compare_runs(conn: sqlite3.Connection, run_a: str, run_b: str):
+    # Diff is computed by SQLite in one statement; delta is NULL when a side is missing
     cur = conn.cursor()
-    cur.execute("SELECT key, value FROM metrics WHERE run_id = ?", (run_a,))
-    a = {r["key"]: r["value"] for r in cur.fetchall()}
-    cur.execute("SELECT key, value FROM metrics WHERE run_id = ?", (run_b,))
-    b = {r["key"]: r["value"] for r in cur.fetchall()}
-
-    keys = sorted(set(a.keys()) | set(b.keys()))
-    diff = []
-    for k in keys:
-        av = a.get(k)
-        bv = b.get(k)
-        if av is None or bv is None:
-            diff.append({"key": k, "a": av, "b": bv, "delta": None})
-        else:
-            diff.append({"key": k, "a": av, "b": bv, "delta": round(bv - av, 3)})
-    return diff
+    cur.execute(_COMPARE_SQL, (run_a, run_b))
+    return dict_rows(cur)
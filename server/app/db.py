@@ -1,7 +1,22 @@
+import hashlib
 import os
+import queue
 import sqlite3
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List
 from .settings import settings
 
+# Applied on every new connection: WAL so readers don't block on the upload writer,
+# 64 MiB page cache and 256 MiB mmap so hot pages skip the read() syscall
+_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-65536",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA busy_timeout=5000",
+)
+
 def connect() -> sqlite3.Connection:
     db_path = settings.db_path
 
@@ -10,16 +25,43 @@ def connect() -> sqlite3.Connection:
     if parent:
         os.makedirs(parent, exist_ok=True)
 
-    conn = sqlite3.connect(db_path, check_same_thread=False)
+    # Pooled connections live for the whole process, so keep more prepared statements around
+    conn = sqlite3.connect(db_path, check_same_thread=False, cached_statements=256)
     conn.row_factory = sqlite3.Row
+    for pragma in _PRAGMAS:
+        conn.execute(pragma)
     return conn
 
-def init_db() -> None:
-    conn = connect()
-    cur = conn.cursor()
+def dict_rows(cur: sqlite3.Cursor) -> List[Dict[str, Any]]:
+    # Build plain dicts straight from the cursor for orjson
+    cols = [d[0] for d in cur.description]
+    return [dict(zip(cols, r)) for r in cur]
 
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS runs (
+# Idle connections shared by request handlers (sync routes run on FastAPI's threadpool)
+_POOL: "queue.Queue[sqlite3.Connection]" = queue.Queue(maxsize=settings.db_pool_size)
+
+@contextmanager
+def get_conn() -> Iterator[sqlite3.Connection]:
+    # Borrow a pooled connection; if all are busy, open an extra one that is closed on return
+    try:
+        conn = _POOL.get_nowait()
+    except queue.Empty:
+        conn = connect()
+    try:
+        yield conn
+    finally:
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            _POOL.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+# metrics and latest_metrics have small rows addressed by their primary key, so they are
+# clustered on it (WITHOUT ROWID); runs carries uname/os_release text and keeps its rowid.
+# `{table}` lets _rebuild_layout create the replacement under a temporary name.
+_RUNS_DDL = """
+    CREATE TABLE IF NOT EXISTS {table} (
       id TEXT PRIMARY KEY,
       created_at TEXT NOT NULL,
       host TEXT NOT NULL,
@@ -27,28 +69,141 @@ def init_db() -> None:
       uname TEXT,
       os_release TEXT
     )
-    """)
+    """
 
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS metrics (
+_METRICS_DDL = """
+    CREATE TABLE IF NOT EXISTS {table} (
       run_id TEXT NOT NULL,
       key TEXT NOT NULL,
       value REAL NOT NULL,
       unit TEXT,
       PRIMARY KEY (run_id, key),
       FOREIGN KEY (run_id) REFERENCES runs(id)
+    ) WITHOUT ROWID
+    """
+
+# Artifact text is stored once per distinct content; runs reference it by hash.
+# Blobs are up to 20 KB, so they stay in a rowid table (WITHOUT ROWID suits small rows).
+_ARTIFACT_BLOBS_DDL = """
+    CREATE TABLE IF NOT EXISTS artifact_blobs (
+      hash BLOB PRIMARY KEY,
+      content TEXT NOT NULL
     )
-    """)
+    """
 
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS artifacts (
+_ARTIFACTS_DDL = """
+    CREATE TABLE IF NOT EXISTS {table} (
       run_id TEXT NOT NULL,
       name TEXT NOT NULL,
-      content TEXT NOT NULL,
+      hash BLOB NOT NULL,
       PRIMARY KEY (run_id, name),
-      FOREIGN KEY (run_id) REFERENCES runs(id)
-    )
+      FOREIGN KEY (run_id) REFERENCES runs(id),
+      FOREIGN KEY (hash) REFERENCES artifact_blobs(hash)
+    ) WITHOUT ROWID
+    """
+
+# Latest value per (host, key) for dashboards
+_LATEST_METRICS_DDL = """
+    CREATE TABLE IF NOT EXISTS {table} (
+      host TEXT NOT NULL,
+      key TEXT NOT NULL,
+      value REAL NOT NULL,
+      created_at TEXT NOT NULL,
+      PRIMARY KEY (host, key)
+    ) WITHOUT ROWID
+    """
+
+def _rebuild_layout(conn: sqlite3.Connection, table: str, ddl: str) -> None:
+    # Rebuild `table` once if its rowid / WITHOUT ROWID layout differs from `ddl`
+    row = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()
+    if row is None or ("WITHOUT ROWID" in row[0].upper()) == ("WITHOUT ROWID" in ddl.upper()):
+        return
+    tmp = f"{table}_rebuild"
+    # Legacy rename leaves triggers/foreign keys that name `table` alone while it is swapped
+    conn.execute("PRAGMA legacy_alter_table=ON")
+    try:
+        with conn:
+            conn.execute("BEGIN")
+            conn.execute(ddl.format(table=tmp))
+            conn.execute(f"INSERT INTO {tmp} SELECT * FROM {table}")
+            conn.execute(f"DROP TABLE {table}")
+            conn.execute(f"ALTER TABLE {tmp} RENAME TO {table}")
+    finally:
+        conn.execute("PRAGMA legacy_alter_table=OFF")
+
+def artifact_hash(content: str) -> bytes:
+    return hashlib.blake2b(content.encode("utf-8", errors="replace"), digest_size=16).digest()
+
+def _migrate_artifact_blobs(conn: sqlite3.Connection) -> None:
+    # Older databases kept artifact text inline in artifacts.content; move it into artifact_blobs once
+    cols = [r[1] for r in conn.execute("PRAGMA table_info(artifacts)")]
+    if "content" not in cols:
+        return
+    conn.execute("PRAGMA legacy_alter_table=ON")
+    try:
+        with conn:
+            conn.execute("BEGIN")
+            conn.execute(_ARTIFACTS_DDL.format(table="artifacts_rebuild"))
+            # Stream rows off their own cursor rather than loading every artifact at once
+            src = conn.cursor()
+            src.execute("SELECT run_id, name, content FROM artifacts")
+            for run_id, name, content in src:
+                h = artifact_hash(content)
+                conn.execute("INSERT OR IGNORE INTO artifact_blobs(hash, content) VALUES(?,?)", (h, content))
+                conn.execute("INSERT INTO artifacts_rebuild(run_id, name, hash) VALUES(?,?,?)", (run_id, name, h))
+            conn.execute("DROP TABLE artifacts")
+            conn.execute("ALTER TABLE artifacts_rebuild RENAME TO artifacts")
+    finally:
+        conn.execute("PRAGMA legacy_alter_table=OFF")
+
+def init_db() -> None:
+    conn = connect()
+    cur = conn.cursor()
+
+    cur.execute(_RUNS_DDL.format(table="runs"))
+    cur.execute(_METRICS_DDL.format(table="metrics"))
+
+    cur.execute(_ARTIFACT_BLOBS_DDL)
+    cur.execute(_ARTIFACTS_DDL.format(table="artifacts"))
+
+    conn.commit()
+    # Databases created with a different table layout get rebuilt once
+    _rebuild_layout(conn, "runs", _RUNS_DDL)
+    _rebuild_layout(conn, "metrics", _METRICS_DDL)
+    _rebuild_layout(conn, "latest_metrics", _LATEST_METRICS_DDL)
+    _migrate_artifact_blobs(conn)
+
+    # Latest value per (host, key) for dashboards, kept current by the trigger below
+    cur.execute(_LATEST_METRICS_DDL.format(table="latest_metrics"))
+
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_metrics_latest AFTER INSERT ON metrics
+    BEGIN
+      INSERT INTO latest_metrics(host, key, value, created_at)
+      SELECT r.host, NEW.key, NEW.value, r.created_at FROM runs r WHERE r.id = NEW.run_id
+      ON CONFLICT(host, key) DO UPDATE SET value = excluded.value, created_at = excluded.created_at
+      WHERE excluded.created_at >= latest_metrics.created_at;
+    END
     """)
 
+    # One-time backfill for databases that predate latest_metrics (later runs overwrite earlier)
+    if cur.execute("SELECT NOT EXISTS (SELECT 1 FROM latest_metrics)").fetchone()[0]:
+        cur.execute("""
+        INSERT OR REPLACE INTO latest_metrics(host, key, value, created_at)
+        SELECT r.host, m.key, m.value, r.created_at
+        FROM metrics m
+        JOIN runs r ON r.id = m.run_id
+        ORDER BY r.created_at
+        """)
+
+    # rolling_metric: range scan on (host, created_at), then a probe into metrics'
+    # clustered (run_id, key) primary key, which already carries value
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_runs_host_created ON runs(host, created_at)")
+    # list_runs: ORDER BY created_at DESC LIMIT ?
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_runs_created ON runs(created_at DESC)")
+
     conn.commit()
     conn.close()
+
+    while not _POOL.full():
+        _POOL.put_nowait(connect())
@@ -1,15 +1,16 @@
 from fastapi import FastAPI, UploadFile, File, HTTPException, Query
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, ORJSONResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
+import io
 import os
 
-from .db import connect, init_db
+from .db import artifact_hash, dict_rows, get_conn, init_db
 from .parser import parse_run
-from .analytics import rolling_metric, compare_runs
+from .analytics import rolling_metric, compare_runs, invalidate, latest_metrics
 from .settings import settings
 
-app = FastAPI(title="OpsLens", version="1.0.0")
+app = FastAPI(title="OpsLens", version="1.0.0", default_response_class=ORJSONResponse)
 
 STATIC_DIR = os.path.join(os.path.dirname(__file__), "..", "static")
 STATIC_DIR = os.path.abspath(STATIC_DIR)
@@ -28,6 +29,30 @@ def index():
 def health():
     return {"ok": True}
 
+class _LimitedReader(io.RawIOBase):
+    """Counts bytes as the decompressor pulls them and aborts once the upload exceeds the cap."""
+
+    def __init__(self, raw, max_bytes: int):
+        super().__init__()
+        self._raw = raw
+        self._max_bytes = max_bytes
+        self._seen = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        chunk = self.read(len(b))
+        b[:len(chunk)] = chunk
+        return len(chunk)
+
+    def read(self, size: int = -1) -> bytes:
+        chunk = self._raw.read(size)
+        self._seen += len(chunk)
+        if self._seen > self._max_bytes:
+            raise HTTPException(status_code=413, detail=f"File too large. Max {settings.max_upload_mb}MB")
+        return chunk
+
 class RunOut(BaseModel):
     id: str
     created_at: str
@@ -36,99 +61,114 @@ class RunOut(BaseModel):
     uname: str | None = None
     os_release: str | None = None
 
+# Plain `def`: parsing and the SQLite writes are blocking, so FastAPI runs this on its
+# threadpool and the event loop keeps serving other requests during a large upload
 @app.post("/api/upload")
-async def upload(file: UploadFile = File(...)):
+def upload(file: UploadFile = File(...)):
     if not file.filename.endswith(".tar.gz"):
         raise HTTPException(status_code=400, detail="Upload must be a .tar.gz produced by cluster_diag.sh")
 
-    data = await file.read()
+    # Starlette has already spooled the whole upload, so its size is known up front;
+    # the parser may stop reading early, so this check can't be left to _LimitedReader
     max_bytes = settings.max_upload_mb * 1024 * 1024
-    if len(data) > max_bytes:
+    size = file.size
+    if size is None:
+        size = file.file.seek(0, os.SEEK_END)
+        file.file.seek(0)
+    if size > max_bytes:
         raise HTTPException(status_code=413, detail=f"File too large. Max {settings.max_upload_mb}MB")
 
-    run_info, metrics, artifacts = parse_run(data, file.filename)
-
-    conn = connect()
-    cur = conn.cursor()
-
-    cur.execute(
-        "INSERT INTO runs(id, created_at, host, archive_name, uname, os_release) VALUES(?,?,?,?,?,?)",
-        (run_info["id"], run_info["created_at"], run_info["host"], run_info["archive_name"], run_info["uname"], run_info["os_release"]),
-    )
-
-    for k, v in metrics.items():
-        unit = "pct" if k.endswith("_pct") else None
-        cur.execute(
-            "INSERT OR REPLACE INTO metrics(run_id, key, value, unit) VALUES(?,?,?,?)",
-            (run_info["id"], k, float(v), unit),
-        )
+    # Stream the spooled upload straight into tarfile instead of buffering it;
+    # _LimitedReader stays as a backstop on the bytes actually read
+    run_info, metrics, artifacts = parse_run(_LimitedReader(file.file, max_bytes), file.filename)
 
+    rid = run_info["id"]
+    metric_rows = [(rid, k, float(v), "pct" if k.endswith("_pct") else None) for k, v in metrics.items()]
+    # parse_run already trimmed each artifact to its tail; identical text is stored once
+    blob_rows = []
+    artifact_rows = []
     for name, content in artifacts.items():
-        # store only the last N chars to avoid huge DB
-        content2 = content[-20000:] if content else ""
+        h = artifact_hash(content)
+        blob_rows.append((h, content))
+        artifact_rows.append((rid, name, h))
+
+    # One transaction for the whole run: `with conn` commits, or rolls back on error
+    with get_conn() as conn, conn:
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
         cur.execute(
-            "INSERT OR REPLACE INTO artifacts(run_id, name, content) VALUES(?,?,?)",
-            (run_info["id"], name, content2),
+            "INSERT INTO runs(id, created_at, host, archive_name, uname, os_release) VALUES(?,?,?,?,?,?)",
+            (rid, run_info["created_at"], run_info["host"], run_info["archive_name"], run_info["uname"], run_info["os_release"]),
         )
+        cur.executemany("INSERT OR REPLACE INTO metrics(run_id, key, value, unit) VALUES(?,?,?,?)", metric_rows)
+        cur.executemany("INSERT OR IGNORE INTO artifact_blobs(hash, content) VALUES(?,?)", blob_rows)
+        cur.executemany("INSERT OR REPLACE INTO artifacts(run_id, name, hash) VALUES(?,?,?)", artifact_rows)
+    invalidate(run_info["host"])
 
-    conn.commit()
-    conn.close()
-
-    return {"run_id": run_info["id"], "host": run_info["host"], "health_score": metrics.get("health_score", None)}
+    return {"run_id": rid, "host": run_info["host"], "health_score": metrics.get("health_score", None)}
 
 @app.get("/api/runs")
 def list_runs(limit: int = Query(50, ge=1, le=200)):
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT id, created_at, host, archive_name, uname, os_release
-        FROM runs
-        ORDER BY created_at DESC
-        LIMIT ?
-        """,
-        (limit,),
-    )
-    rows = [dict(r) for r in cur.fetchall()]
-    conn.close()
-    return rows
-
-@app.get("/api/runs/{run_id}")
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT id, created_at, host, archive_name, uname, os_release
+            FROM runs
+            ORDER BY created_at DESC
+            LIMIT ?
+            """,
+            (limit,),
+        )
+        rows = dict_rows(cur)
+    # Returning the response directly skips FastAPI's jsonable_encoder pass
+    return ORJSONResponse(rows)
+
+@app.get("/api/runs/{run_id}", response_model=None)
 def run_detail(run_id: str):
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM runs WHERE id = ?", (run_id,))
-    r = cur.fetchone()
-    if not r:
-        conn.close()
-        raise HTTPException(status_code=404, detail="Run not found")
-
-    cur.execute("SELECT key, value, unit FROM metrics WHERE run_id = ? ORDER BY key", (run_id,))
-    metrics = [dict(m) for m in cur.fetchall()]
-    conn.close()
-    return {"run": dict(r), "metrics": metrics}
-
-@app.get("/api/runs/{run_id}/artifact")
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT * FROM runs WHERE id = ?", (run_id,))
+        r = cur.fetchone()
+        if not r:
+            raise HTTPException(status_code=404, detail="Run not found")
+
+        cur.execute("SELECT key, value, unit FROM metrics WHERE run_id = ? ORDER BY key", (run_id,))
+        metrics = dict_rows(cur)
+    return ORJSONResponse({"run": dict(r), "metrics": metrics})
+
+@app.get("/api/runs/{run_id}/artifact", response_model=None)
 def run_artifact(run_id: str, name: str):
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute("SELECT content FROM artifacts WHERE run_id = ? AND name = ?", (run_id, name))
-    row = cur.fetchone()
-    conn.close()
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT b.content
+            FROM artifacts a
+            JOIN artifact_blobs b ON b.hash = a.hash
+            WHERE a.run_id = ? AND a.name = ?
+            """,
+            (run_id, name),
+        )
+        row = cur.fetchone()
     if not row:
         raise HTTPException(status_code=404, detail="Artifact not found")
-    return {"name": name, "content": row["content"]}
+    return ORJSONResponse({"name": name, "content": row["content"]})
 
 @app.get("/api/analytics/rolling")
 def analytics_rolling(host: str, key: str, days: int = Query(30, ge=1, le=365)):
-    conn = connect()
-    out = rolling_metric(conn, host=host, key=key, days=days)
-    conn.close()
-    return out
+    with get_conn() as conn:
+        out = rolling_metric(conn, host=host, key=key, days=days)
+    return ORJSONResponse(out)
+
+@app.get("/api/analytics/latest")
+def analytics_latest(host: str):
+    with get_conn() as conn:
+        out = latest_metrics(conn, host=host)
+    return ORJSONResponse(out)
 
 @app.get("/api/compare")
 def compare(run_a: str, run_b: str):
-    conn = connect()
-    out = compare_runs(conn, run_a=run_a, run_b=run_b)
-    conn.close()
-    return out
+    with get_conn() as conn:
+        out = compare_runs(conn, run_a=run_a, run_b=run_b)
+    return ORJSONResponse(out)
@@ -1,61 +1,118 @@
-import io
 import os
 import re
 import tarfile
 import uuid
 from datetime import datetime, timezone
-from typing import Dict, Tuple
-
-ERROR_RE = re.compile(r"\b(error|failed|fail|panic|critical|segfault)\b", re.IGNORECASE)
-
-def _safe_members(t: tarfile.TarFile):
-    # prevent path traversal
-    for m in t.getmembers():
-        p = m.name
-        if p.startswith("/") or ".." in p.split("/"):
-            continue
-        if m.islnk() or m.issym():
-            continue
-        yield m
-
-def _read_text(t: tarfile.TarFile, name_endswith: str) -> str:
-    # Find a member ending with name_endswith (since top folder includes host-timestamp)
-    member = next((m for m in t.getmembers() if m.name.endswith("/" + name_endswith) or m.name.endswith(name_endswith)), None)
-    if not member:
-        return ""
-    f = t.extractfile(member)
-    if not f:
-        return ""
-    data = f.read()
+from typing import BinaryIO, Dict, Tuple
+
+try:
+    # ISA-L (SIMD) inflate; falls back to tarfile's own zlib path when not installed
+    from isal import igzip
+except ImportError:
+    igzip = None
+
+# Whole-buffer patterns: one C-level scan per artifact instead of a Python loop per line
+# Count-only artifacts (log tail, systemd lists) are matched on raw bytes, never decoded in full
+# ERROR_RE_BYTES matches at most once per line, so findall() counts lines with an error signal
+ERROR_RE_BYTES = re.compile(rb"^.*?\b(error|failed|fail|panic|critical|segfault)\b", re.IGNORECASE | re.MULTILINE)
+RUNNING_SVC_RE_BYTES = re.compile(rb"(?m)^.*\.service\b.*\bloaded\b")
+FAILED_RE_BYTES = re.compile(rb"(?m)^.*\.service.*\bfailed\b")
+MEM_RE = re.compile(r"(?m)^[ \t]*Mem:[ \t]+(\d+)[ \t]+(\d+)")
+DF_ROOT_RE = re.compile(r"(?m)^\S.*[ \t](\d+)%[ \t]+/[ \t]*$")
+# kubectl table rows (header included); lines starting with "#" are the collector's "### CMD" preamble
+K8S_ROW_RE = re.compile(r"(?m)^[^#\s]")
+# `kubectl get nodes` row: NAME, then the first word of STATUS ("Ready,SchedulingDisabled" -> "Ready")
+NODE_RE = re.compile(r"(?m)^([^#\s]\S*)[ \t]+(\w+)")
+
+# Files we pull out of the collector archive (top folder includes host-timestamp)
+WANTED = frozenset({
+    "meta.txt",
+    "uname.txt",
+    "os_release.txt",
+    "df.txt",
+    "free.txt",
+    "log_tail.txt",
+    "systemd_running_services.txt",
+    "systemd_failed_units.txt",
+    "k8s_nodes.txt",
+    "k8s_pods.txt",
+})
+
+# Read the gzip stream in large blocks to keep syscalls down
+STREAM_BUFSIZE = 2 * 1024 * 1024
+READ_CHUNK = 64 * 1024
+# Per-member read cap (bounds memory against oversized or gzip-bomb members)
+MEMBER_MAX_BYTES = 4 * 1024 * 1024
+# Artifacts are stored for the UI as their trailing bytes only
+ARTIFACT_MAX_BYTES = 20000
+
+def _decode(data: bytes) -> str:
     try:
         return data.decode("utf-8", errors="replace")
     except Exception:
         return data.decode(errors="replace")
 
-def parse_run(archive_bytes: bytes, archive_name: str) -> Tuple[dict, Dict[str, float], Dict[str, str]]:
+def _read_tail(f: BinaryIO, size: int, limit: int) -> bytes:
+    # A streamed member has to be consumed in full; keep only its trailing `limit` bytes
+    if size <= limit:
+        return f.read()
+    buf = bytearray()
+    while True:
+        chunk = f.read(READ_CHUNK)
+        if not chunk:
+            break
+        buf += chunk
+        if len(buf) > limit:
+            del buf[:-limit]
+    return bytes(buf)
+
+def _read_wanted(t: tarfile.TarFile) -> Dict[str, bytes]:
+    # One forward pass over the stream, keyed by basename; stop once everything is found
+    found: Dict[str, bytes] = {}
+    for m in t:
+        base = m.name.rsplit("/", 1)[-1]
+        if base not in WANTED or base in found or not m.isfile():
+            continue
+        # prevent path traversal (isfile() already excludes links)
+        if m.name.startswith("/") or ".." in m.name.split("/"):
+            continue
+        f = t.extractfile(m)
+        if not f:
+            continue
+        found[base] = _read_tail(f, m.size, MEMBER_MAX_BYTES)
+        if len(found) == len(WANTED):
+            break
+    return found
+
+def parse_run(fileobj: BinaryIO, archive_name: str) -> Tuple[dict, Dict[str, float], Dict[str, str]]:
     """
+    Reads the .tar.gz from `fileobj` as a stream (no seeking, single pass).
     Returns: run_info, metrics, artifacts
     - run_info: id, created_at, host, archive_name, uname, os_release
     - metrics: numeric values
-    - artifacts: raw text blobs (for UI)
+    - artifacts: raw text blobs (for UI), last ARTIFACT_MAX_BYTES of each file
     """
-    run_id = str(uuid.uuid4())
+    run_id = uuid.uuid4().hex
     created_at = datetime.now(timezone.utc).isoformat()
 
-    with tarfile.open(fileobj=io.BytesIO(archive_bytes), mode="r:gz") as t:
-        # Validate members quickly (safe)
-        _ = list(_safe_members(t))
-
-        meta = _read_text(t, "meta.txt")
-        uname = _read_text(t, "uname.txt")
-        os_release = _read_text(t, "os_release.txt")
-        df_txt = _read_text(t, "df.txt")
-        free_txt = _read_text(t, "free.txt")
-        log_tail = _read_text(t, "log_tail.txt")
-        running_services = _read_text(t, "systemd_running_services.txt")
-        failed_units = _read_text(t, "systemd_failed_units.txt")
-        k8s_nodes = _read_text(t, "k8s_nodes.txt")
-        k8s_pods = _read_text(t, "k8s_pods.txt")
+    if igzip is not None:
+        stream, mode = igzip.IGzipFile(fileobj=fileobj, mode="rb"), "r|"
+    else:
+        stream, mode = fileobj, "r|gz"
+
+    with tarfile.open(fileobj=stream, mode=mode, bufsize=STREAM_BUFSIZE) as t:
+        raw = _read_wanted(t)
+
+    meta = _decode(raw.get("meta.txt", b""))
+    uname = _decode(raw.get("uname.txt", b""))
+    os_release = _decode(raw.get("os_release.txt", b""))
+    df_txt = _decode(raw.get("df.txt", b""))
+    free_txt = _decode(raw.get("free.txt", b""))
+    log_tail = raw.get("log_tail.txt", b"")
+    running_services = raw.get("systemd_running_services.txt", b"")
+    failed_units = raw.get("systemd_failed_units.txt", b"")
+    k8s_nodes = _decode(raw.get("k8s_nodes.txt", b""))
+    k8s_pods = _decode(raw.get("k8s_pods.txt", b""))
 
     host = "unknown"
     for line in meta.splitlines():
@@ -64,110 +121,72 @@ def parse_run(archive_bytes: bytes, archive_name: str) -> Tuple[dict, Dict[str,
 
     metrics: Dict[str, float] = {}
 
-    # Parse memory from `free -b` (line starts with Mem:)
-    mem_total = mem_used = None
-    for line in free_txt.splitlines():
-        if line.strip().startswith("Mem:"):
-            parts = line.split()
-            # Mem: total used free shared buff/cache available
-            if len(parts) >= 3:
-                mem_total = float(parts[1])
-                mem_used = float(parts[2])
-            break
-    if mem_total and mem_used is not None and mem_total > 0:
-        metrics["mem_used_pct"] = round((mem_used / mem_total) * 100.0, 2)
-        metrics["mem_used_bytes"] = mem_used
-        metrics["mem_total_bytes"] = mem_total
-
-    # Parse disk root usage from df -P
-    # Look for mount point "/"
-    root_use = None
-    for line in df_txt.splitlines():
-        if not line.strip() or line.lower().startswith("filesystem"):
-            continue
-        parts = line.split()
-        if len(parts) >= 7 and parts[-1] == "/":
-            # ... Use% is typically parts[-2]
-            usep = parts[-2].strip()
-            if usep.endswith("%"):
-                try:
-                    root_use = float(usep[:-1])
-                except ValueError:
-                    pass
-            break
-    if root_use is not None:
-        metrics["disk_root_used_pct"] = root_use
+    # Parse memory from `free -b` (Mem: total used free shared buff/cache available)
+    m = MEM_RE.search(free_txt)
+    if m:
+        mem_total = float(m.group(1))
+        mem_used = float(m.group(2))
+        if mem_total > 0:
+            metrics["mem_used_pct"] = round((mem_used / mem_total) * 100.0, 2)
+            metrics["mem_used_bytes"] = mem_used
+            metrics["mem_total_bytes"] = mem_total
+
+    # Parse disk root usage from df -P: Use% on the row mounted at "/"
+    m = DF_ROOT_RE.search(df_txt)
+    if m:
+        metrics["disk_root_used_pct"] = float(m.group(1))
 
     # systemd running services count (rough)
-    run_count = 0
-    for line in running_services.splitlines():
-        if line.strip().endswith(".service") and "loaded" in line:
-            run_count += 1
-    metrics["systemd_running_services"] = float(run_count)
+    metrics["systemd_running_services"] = float(len(RUNNING_SVC_RE_BYTES.findall(running_services)))
 
     # failed units count (rough)
-    failed_count = 0
-    for line in failed_units.splitlines():
-        if ".service" in line and "failed" in line:
-            failed_count += 1
-    metrics["systemd_failed_units"] = float(failed_count)
+    metrics["systemd_failed_units"] = float(len(FAILED_RE_BYTES.findall(failed_units)))
 
     # log error signals count
-    err_count = sum(1 for line in log_tail.splitlines() if ERROR_RE.search(line))
-    metrics["log_error_signals_200lines"] = float(err_count)
+    metrics["log_error_signals_200lines"] = float(len(ERROR_RE_BYTES.findall(log_tail)))
 
     # k8s nodes/pods counts
     # `kubectl get nodes` has header NAME STATUS ROLES AGE VERSION ...
     if k8s_nodes and "kubectl not found" not in k8s_nodes.lower():
-        lines = [ln for ln in k8s_nodes.splitlines() if ln.strip()]
-        if len(lines) > 1:
-            metrics["k8s_nodes_total"] = float(len(lines) - 1)
-            not_ready = 0
-            for ln in lines[1:]:
-                cols = ln.split()
-                if len(cols) >= 2 and "Ready" not in cols[1]:
-                    not_ready += 1
-            metrics["k8s_nodes_not_ready"] = float(not_ready)
+        rows = NODE_RE.finditer(k8s_nodes)
+        if next(rows, None) is not None:  # header
+            total = not_ready = 0
+            for m in rows:
+                total += 1
+                not_ready += m.group(2) != "Ready"
+            if total:
+                metrics["k8s_nodes_total"] = float(total)
+                metrics["k8s_nodes_not_ready"] = float(not_ready)
 
     if k8s_pods and "kubectl not found" not in k8s_pods.lower():
-        lines = [ln for ln in k8s_pods.splitlines() if ln.strip()]
-        if len(lines) > 1:
-            metrics["k8s_pods_total"] = float(len(lines) - 1)
+        n_rows = len(K8S_ROW_RE.findall(k8s_pods))
+        if n_rows > 1:
+            metrics["k8s_pods_total"] = float(n_rows - 1)
 
     # Health score (simple but compelling)
-    score = 100.0
     disk = metrics.get("disk_root_used_pct", 0.0)
     mem = metrics.get("mem_used_pct", 0.0)
     errs = metrics.get("log_error_signals_200lines", 0.0)
     not_ready = metrics.get("k8s_nodes_not_ready", 0.0)
     failed = metrics.get("systemd_failed_units", 0.0)
 
-    if disk >= 90: score -= 25
-    elif disk >= 80: score -= 15
-    elif disk >= 70: score -= 8
-
-    if mem >= 90: score -= 25
-    elif mem >= 80: score -= 15
-    elif mem >= 70: score -= 8
+    # Cumulative step penalties: 8 at >=70%, 15 at >=80%, 25 at >=90%
+    disk_pen = 8 * (disk >= 70) + 7 * (disk >= 80) + 10 * (disk >= 90)
+    mem_pen = 8 * (mem >= 70) + 7 * (mem >= 80) + 10 * (mem >= 90)
 
-    score -= min(20.0, errs * 2.0)
-    score -= min(15.0, failed * 5.0)
-    score -= min(20.0, not_ready * 10.0)
+    score = (
+        100.0
+        - disk_pen
+        - mem_pen
+        - min(20.0, errs * 2.0)
+        - min(15.0, failed * 5.0)
+        - min(20.0, not_ready * 10.0)
+    )
 
     metrics["health_score"] = float(max(0.0, round(score, 1)))
 
-    artifacts = {
-        "meta.txt": meta,
-        "uname.txt": uname,
-        "os_release.txt": os_release,
-        "df.txt": df_txt,
-        "free.txt": free_txt,
-        "log_tail.txt": log_tail,
-        "systemd_running_services.txt": running_services,
-        "systemd_failed_units.txt": failed_units,
-        "k8s_nodes.txt": k8s_nodes,
-        "k8s_pods.txt": k8s_pods,
-    }
+    # Decode only the stored tail rather than slicing an already-decoded copy
+    artifacts = {name: _decode(raw.get(name, b"")[-ARTIFACT_MAX_BYTES:]) for name in sorted(WANTED)}
 
     run_info = {
         "id": run_id,
@@ -4,5 +4,6 @@ from pydantic import BaseModel
 class Settings(BaseModel):
     db_path: str = os.environ.get("OPSLENS_DB_PATH", "opslens.db")
     max_upload_mb: int = int(os.environ.get("OPSLENS_MAX_UPLOAD_MB", "20"))
+    db_pool_size: int = int(os.environ.get("OPSLENS_DB_POOL_SIZE", "8"))
 
 settings = Settings()